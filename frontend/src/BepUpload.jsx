@@ -32,31 +32,47 @@ export default function BepUpload(){
 
             if(!initRes.ok) throw new Error("Init upload failed");
 
-            const {file_id, url, fields} = await initRes.json();
+            const {file_id, url, fields, upload_id, part_size, part_urls} = await initRes.json();
             setFileId(file_id);
 
             setStatus("uploading");
 
+            let parts = null;
 
-            const formData = new FormData();
-            Object.entries(fields).forEach(([k, v]) => 
-                formData.append(k,v )
-            );
-            formData.append("file", file);
+            if(upload_id){
+                // large file: PUT every part straight to s3 in parallel
+                parts = await Promise.all(part_urls.map(async (partUrl, i) => {
+                    const partRes = await fetch(partUrl, {
+                        method: "PUT",
+                        body: file.slice(i * part_size, (i + 1) * part_size),
+                    });
 
-            const s3Res = await fetch(url, {
-                method: "POST",
-                body: formData,
-            });
+                    if(!partRes.ok) throw new Error(`S3 upload of part ${i + 1} failed`);
 
-            if(!s3Res.ok) throw new Error("S3 upload failed");
+                    return {part_number: i + 1, etag: partRes.headers.get("ETag")};
+                }));
+            }
+            else{
+                const formData = new FormData();
+                Object.entries(fields).forEach(([k, v]) =>
+                    formData.append(k,v )
+                );
+                formData.append("file", file);
+
+                const s3Res = await fetch(url, {
+                    method: "POST",
+                    body: formData,
+                });
+
+                if(!s3Res.ok) throw new Error("S3 upload failed");
+            }
 
             setStatus("finalizing");
 
             const completeRes = await fetch(`${API_BASE}/upload/complete`, {
                 method: "POST",
                 headers: {"Content-Type": "application/json"},
-                body: JSON.stringify({file_id}),
+                body: JSON.stringify({file_id, parts}),
             });
 
             const completeData = await completeRes.json();
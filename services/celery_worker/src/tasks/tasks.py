@@ -1,8 +1,13 @@
 from celery import Celery
 import os
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import json
+from io import BytesIO
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 import logging
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 from src.core.config import settings
 from src.models.uploads import update_upload_status, UploadStatus
@@ -11,55 +16,100 @@ from src.services.bep_parser import BEPParser
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Weaviate
 import weaviate
+from weaviate.exceptions import UnexpectedStatusCodeException
 
 os.environ['FORKED_BY_MULTIPROCESSING'] = '1'
 log = logging.getLogger(__name__)
 
 app = Celery("src", broker=settings.celery_broker_url, backend=settings.celery_result_backend)
+# BEP processing is I/O bound and is consumed by the gevent worker listening on "bep"
+app.conf.task_routes = {"process_bep_file": {"queue": "bep"}}
+# ack only after the task finishes so a worker that dies mid-file hands it back to the queue;
+# each greenlet reserves one task at a time since a BEP file takes a while
+app.conf.update(
+    broker_pool_limit=50,
+    broker_connection_retry_on_startup=True,
+    result_expires=3600,
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+)
 
 # embedding client and vector DB client (Weaviate)
 embedding_client = OpenAIEmbeddings(openai_api_key=settings.openai_api_key)
 weaviate_client = weaviate.Client("http://localhost:8080")
 
+# rag-chat pre-filters its near_vector search on file_id, so the property needs an inverted
+# index; vectors are supplied by the worker, hence no vectorizer module
+_DOCUMENT_CLASS = {
+    "class": "Document",
+    "vectorizer": "none",
+    "properties": [
+        {"name": "text", "dataType": ["text"], "indexFilterable": False, "indexSearchable": False},
+        {"name": "file_id", "dataType": ["text"], "tokenization": "field", "indexFilterable": True},
+        {"name": "type", "dataType": ["text"], "tokenization": "field", "indexFilterable": True},
+    ],
+}
+_document_class_ready = False
+
+
+def _ensure_document_class() -> None:
+    global _document_class_ready
+    if _document_class_ready:
+        return
+    if not weaviate_client.schema.exists(_DOCUMENT_CLASS["class"]):
+        try:
+            weaviate_client.schema.create_class(_DOCUMENT_CLASS)
+        except UnexpectedStatusCodeException:
+            # another greenlet or worker created it first
+            if not weaviate_client.schema.exists(_DOCUMENT_CLASS["class"]):
+                raise
+    _document_class_ready = True
+
 
 _s3_client = boto3.client(
     "s3",
     region_name = settings.aws_region,
     aws_access_key_id = settings.aws_access_key_id,
     aws_secret_access_key = settings.aws_secret_access_key,
-    endpoint_url = "http://localhost:4566"
+    endpoint_url = "http://localhost:4566",
+    # one client is shared by every greenlet of the gevent pool (-c 50), so size the connection
+    # pool to match and let botocore back off adaptively when s3 throttles
+    config = Config(max_pool_connections=50, retries={"max_attempts": 5, "mode": "adaptive"}),
 )
 
+# processed outputs at or above this size go up as parallel multipart parts; smaller ones
+# (summary, resource usage, most graphs) stay a single put_object round trip
+_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+_transfer_config = TransferConfig(multipart_threshold=_MULTIPART_THRESHOLD, max_concurrency=4, use_threads=True)
+
+
+def _upload_json(key: str, body: bytes) -> None:
+    if len(body) >= _MULTIPART_THRESHOLD:
+        _s3_client.upload_fileobj(
+            BytesIO(body),
+            settings.s3_bucket,
+            key,
+            Config = _transfer_config,
+            ExtraArgs = {"ContentType": "application/json"},
+        )
+    else:
+        _s3_client.put_object(
+            Bucket = settings.s3_bucket,
+            Key = key,
+            Body = body,
+            ContentType = "application/json",
+        )
+
 # register the task with unique name - the path
 @app.task(name="process_bep_file", bind=True, max_retries=1, default_retry_delay=5)
 def process_bep_file(self, file_id: str, s3_key: str) -> None:
-    print("here")
+    log.debug("processing %s (%s)", file_id, s3_key)
     try:
         update_upload_status(file_id, UploadStatus.PROCESSING)
 
-        # contact s3 for the file
-        obj = _s3_client.get_object(Bucket=settings.s3_bucket, Key=s3_key)
-        # extract the streaming object from the S3 response. This object is a file-like handle
-        # that starts downloading the data only when the code iterates over it. 
-        body = obj["Body"]
-
+        # stream the file from s3 straight into the parser
         parser = BEPParser()
-
-        # lines is a generator
-        def lines():
-            for raw_line in body.iter_lines(chunk_size=65536):
-                # skip blank lines
-                if not raw_line:
-                    continue
-                try:
-                    # decode the bytes into a string using standard UTF-8 encoding, which is default for JSON
-                    line = raw_line.decode("utf-8")
-                except Exception:
-                    # fallback when decoding fails
-                    line = raw_line.decode("latin-1", errors="ignore")
-                yield line    # pass the decoded string line back to the function that called the generator.
-        
-        parser.parse_stream(lines())
+        parser.parse_s3(_s3_client, settings.s3_bucket, s3_key)
 
         
         # Build summary
@@ -70,27 +120,18 @@ def process_bep_file(self, file_id: str, s3_key: str) -> None:
 
         base_key = f"processed/{file_id}/"
 
-        # Putting the results back to s3
-        _s3_client.put_object(
-            Bucket = settings.s3_bucket,
-            Key = base_key + "summary.json",
-            Body = processed_summary,
-            ContentType = "application/json",
-        )
-
-        _s3_client.put_object(
-            Bucket = settings.s3_bucket,
-            Key = base_key + "graph.json",
-            Body = processed_graph,
-            ContentType = "application/json",
-        )
-
-        _s3_client.put_object(
-            Bucket = settings.s3_bucket,
-            Key = base_key + "resource-usage.json",
-            Body = processed_resource_usage,
-            ContentType = "application/json",
+        # Putting the results back to s3. The three uploads are independent, so run them
+        # concurrently on the (thread-safe) shared client instead of one round trip after another.
+        outputs = (
+            ("summary.json", processed_summary),
+            ("graph.json", processed_graph),
+            ("resource-usage.json", processed_resource_usage),
         )
+        with ThreadPoolExecutor(max_workers=len(outputs)) as pool:
+            uploads = [pool.submit(_upload_json, base_key + name, body) for name, body in outputs]
+            # result() re-raises any s3 error here, so the retry handling below still applies
+            for upload in uploads:
+                upload.result()
 
         # Embeddings processing
         # for each, creating dictionaries
@@ -100,6 +141,7 @@ def process_bep_file(self, file_id: str, s3_key: str) -> None:
             "resource_usage": json.loads(processed_resource_usage),
         }
 
+        _ensure_document_class()
         for dtype, data in data_dicts.items():
             # convert to JSON string, indent = 2 for pretty printing
             text = json.dumps(data, indent = 2)
@@ -127,7 +169,8 @@ def process_bep_file(self, file_id: str, s3_key: str) -> None:
         update_upload_status(file_id, UploadStatus.COMPLETED, output_location=base_key)
         log.info("Processed BEP file %s -> %s", s3_key, base_key)
 
-    except(BotoCoreError, ClientError) as s3_err:
+    # upload_fileobj wraps s3 failures in S3UploadFailedError rather than ClientError
+    except(BotoCoreError, ClientError, S3UploadFailedError) as s3_err:
         log.exception("s3 error while processing %s -> %s", s3_key, s3_err)
         try:
             raise self.retry(exc=s3_err)
@@ -1,11 +1,19 @@
-import json
+import math
 import os
-from dataclasses import dataclass, field
+import uuid
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple
+import faiss
+import numpy as np
+import orjson
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -14,6 +22,8 @@ from langchain.vectorstores import FAISS
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
 from dotenv import load_dotenv
 
 
@@ -21,15 +31,30 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+# Events handed to the embedding pool per batch while the parser keeps reading
+RAG_BATCH_SIZE = 500
+RAG_EMBED_WORKERS = 4
+
+# From this many chunks on, the flat FP32 index's memory and O(N·D) queries start to hurt,
+# so we switch to IVF with 8-bit product quantization (48 sub-quantizers of the 1536-d vectors)
+IVFPQ_MIN_VECTORS = 10_000
+IVFPQ_SUBQUANTIZERS = 48
+IVFPQ_NPROBE = 16
+
+
 class BEPRAGProcessor:
     def __init__(self):
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200
         )
+        # one request per 2048 chunks instead of the default 1000
         self.embeddings = OpenAIEmbeddings(
             openai_api_key = os.getenv("OPENAI_API_KEY"),
-            model = "text-embedding-ada-002"
+            model = "text-embedding-3-small",
+            chunk_size = 2048,
+            max_retries = 6,
+            request_timeout = 30,
         )
         self.vector_store = None
         self.qa_chain = None
@@ -37,22 +62,58 @@ class BEPRAGProcessor:
             memory_key = 'chat_history',
             return_messages=True
         )
+        # background embedding of event batches (see start/submit_events/finish)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: List[Future] = []
+        self._query_lock = Lock()
     
     def process_bep_data(self, bep_events: List[Dict[str, Any]]) -> None:
         """Process BEP data into searchable chunks"""
-        # convert events to text
-        texts = []
-        for event in bep_events:
-            # Convert each event to a structured text representation
-            text = f"Event Type: {list(event.get('id', {}).keys())[0] if event.get('id') else 'unknown'}\n"
-            text += json.dumps(event, indent=2)
-            texts.append(text)
-
-        #create chunks
-        chunks = self.text_splitter.create_documents(texts)
+        self.start()
+        for i in range(0, len(bep_events), RAG_BATCH_SIZE):
+            self.submit_events(bep_events[i:i + RAG_BATCH_SIZE])
+        self.finish()
+
+    def start(self) -> None:
+        """Begin a new index build; submitted batches are embedded on a thread pool"""
+        self._executor = ThreadPoolExecutor(max_workers=RAG_EMBED_WORKERS)
+        self._pending = []
+
+    def submit_events(self, bep_events: List[Dict[str, Any]]) -> None:
+        """Queue a batch of events for embedding and return immediately"""
+        # the OpenAI client releases the GIL while waiting on the network, so batch j
+        # is embedded while the caller is still parsing batch j+1
+        self._pending.append(self._executor.submit(self._embed_events, bep_events))
+
+    def cancel(self) -> None:
+        """Drop an index build that won't be finished; batches not yet started are not embedded"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._pending = []
+
+    def finish(self) -> None:
+        """Wait for all submitted batches and build the vector store and QA chain"""
+        texts: List[str] = []
+        vectors: List[List[float]] = []
+        try:
+            for future in self._pending:
+                batch_texts, batch_vectors = future.result()
+                texts.extend(batch_texts)
+                vectors.extend(batch_vectors)
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+            self._pending = []
+
+        if not texts:
+            return
 
-        #create vector store
-        self.vector_store = FAISS.from_documents(chunks, self.embeddings)
+        #create vector store from the precomputed embeddings
+        if len(vectors) >= IVFPQ_MIN_VECTORS and len(vectors[0]) % IVFPQ_SUBQUANTIZERS == 0:
+            self.vector_store = self._build_ivfpq_store(texts, vectors)
+        else:
+            self.vector_store = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings)
 
         # Initialize QA chain
         llm = ChatOpenAI(temperature = 0)
@@ -62,12 +123,48 @@ class BEPRAGProcessor:
             memory=self.memory
         )
 
+    def _build_ivfpq_store(self, texts: List[str], vectors: List[List[float]]) -> FAISS:
+        vecs = np.asarray(vectors, dtype=np.float32)
+        n, d = vecs.shape
+        nlist = int(math.sqrt(n))
+
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, nlist, IVFPQ_SUBQUANTIZERS, 8)
+        index.train(vecs)
+        index.add(vecs)
+        index.nprobe = min(nlist, IVFPQ_NPROBE)
+
+        ids = [str(uuid.uuid4()) for _ in texts]
+        docstore = InMemoryDocstore({i: Document(page_content=t) for i, t in zip(ids, texts)})
+        return FAISS(self.embeddings, index, docstore, dict(enumerate(ids)))
+
+    def _embed_events(self, bep_events: List[Dict[str, Any]]) -> Tuple[List[str], List[List[float]]]:
+        # convert events to text
+        texts = [self._event_to_text(event) for event in bep_events]
+
+        #create chunks
+        chunks = [doc.page_content for doc in self.text_splitter.create_documents(texts)]
+        if not chunks:
+            return [], []
+
+        # the client already retries rate-limit, timeout and connection errors (max_retries);
+        # anything else (bad key, malformed input) fails the batch straight away
+        return chunks, self.embeddings.embed_documents(chunks)
+
+    @staticmethod
+    def _event_to_text(event: Dict[str, Any]) -> str:
+        # Convert each event to a structured text representation
+        event_id = event.get("id")
+        event_type = next(iter(event_id), "unknown") if isinstance(event_id, dict) else "unknown"
+        return f"Event Type: {event_type}\n" + orjson.dumps(event, option=orjson.OPT_INDENT_2).decode()
+
     def query(self, question: str) -> str:
         """Query the BEP data using RAG"""
         if not self.qa_chain:
             raise ValueError("BEP data not processed yet")
         
-        result = self.qa_chain({"question": question})
+        # the chain's conversation memory is shared, so one question at a time
+        with self._query_lock:
+            result = self.qa_chain({"question": question})
         return result['answer']
     
 
@@ -77,12 +174,79 @@ class BEPRAGProcessor:
 # Data types
 # =========
 
-@dataclass
+NAN = float("nan")
+
+# top-level keys that can hold a resource point; see _maybe_extract_resource_point
+_RESOURCE_KEYS = frozenset(("progress", "buildMetrics", "timeMillis", "timestamp"))
+
+# shared read-only default for missing payloads, so lookups don't build a fresh {} per event.
+# Never mutate it.
+_EMPTY: Dict[str, Any] = {}
+
+# "/" and ":" can be problematic for some graph visualization libraries; swap both in one pass
+_SAFE_ID_TABLE = str.maketrans("/:", "__")
+
+
+# BEP JSON only ever decodes to builtin types, so the resource probes compare type() directly
+# instead of paying for isinstance's subclass check (this also keeps bools out of the series)
+def _num(x: Any) -> Optional[float]:
+    return float(x) if type(x) in (int, float) else None
+
+
+# fallback key lists for the resource fields, in order of preference
+_RU_CPU_KEYS = ("cpuUsage", "cpu", "cpu_utilization")
+_RU_MEM_KEYS = ("memoryUsage", "memory", "mem")
+_BM_MEM_KEYS = ("peak", "highWatermark", "used")
+_BM_CPU_KEYS = ("cpu", "utilization", "processTimeMs")
+
+
+def _first_num(d: Dict[str, Any], keys: Tuple[str, ...]) -> Optional[float]:
+    # _num(d.get(k1) or d.get(k2) or ...): the first truthy value wins, so a 0 or a missing key
+    # falls through to the next one
+    for k in keys:
+        v = d.get(k)
+        if v:
+            return _num(v)
+    return None
+
+
+def _iter_jsonl_bytes(fp: BinaryIO, bufsize: int = 1 << 20) -> Iterator[bytes]:
+    # Yield the non-empty lines of a binary JSONL stream (anything with read(n) -> bytes), without
+    # the newline. Each bufsize chunk is split with a single C-level splitlines() call; a partial
+    # last line is carried over into the next chunk.
+    tail = b""
+    while True:
+        chunk = fp.read(bufsize)
+        if not chunk:
+            break
+        buf = tail + chunk if tail else chunk
+        lines = buf.splitlines()
+        # unless the chunk ended exactly on a newline, its last line is still incomplete
+        tail = b"" if buf.endswith(b"\n") else lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if tail:
+        yield tail
+
+
 class Target:
-    label: str
-    status: str = "unknown"           # "unknown" | "success" | "failure"
-    kind: Optional[str] = None
-    dependencies: Set[str] = field(default_factory=set)
+    # slots instead of a per-instance __dict__; builds can have 100k+ targets
+    __slots__ = ("label", "status", "kind", "dependencies", "node_id", "short_label", "group")
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        # DOM-safe graph id, computed once per target rather than on every graph build
+        self.node_id = label.translate(_SAFE_ID_TABLE)
+        # graph display fields, derived once here instead of re-splitting the label on every /api/graph
+        # "//pkg/sub:name" -> short_label "sub:name", group = the second "/"-separated part ("" for "//...")
+        self.short_label = label.rpartition("/")[2]
+        _, sep, rest = label.partition("/")
+        self.group = rest.partition("/")[0] if sep else "root"
+        self.status = "unknown"           # "unknown" | "success" | "failure"
+        self.kind: Optional[str] = None
+        # most targets never report deps, so the set is only allocated for the first one
+        self.dependencies: Optional[Set[str]] = None
 
 
 # ======================
@@ -105,67 +269,97 @@ class BEPParser:
     """
 
     def __init__(self) -> None:
-        self.events: List[Dict[str, Any]] = []
+        # bumped whenever the parsed state changes, so derived responses know when to rebuild
+        self.version: int = 0
 
         # Graph/targets/tests/action counts
         self.targets: Dict[str, Target] = {}
         self.test_results: Dict[str, Dict[str, Any]] = {}
         self.action_count: int = 0
 
-        # Resource series (best effort)
+        # Resource series (best effort), one packed float64 column per field; NaN marks a missing value
         # time: milliseconds (if available); cpu/memory: numeric (unit depends on Bazel version)
-        self.resource_series: List[Dict[str, Optional[float]]] = []
+        self.resource_time = array("d")
+        self.resource_cpu = array("d")
+        self.resource_memory = array("d")
         self.rag_processor = BEPRAGProcessor()
 
+        # event["id"] key -> handler(event, id_payload), built once instead of an if/elif chain per event.
+        # Some Bazel versions use "configuredTarget", others "targetConfigured".
+        self._dispatch: Dict[str, Callable[[Dict[str, Any], Dict[str, Any]], None]] = {
+            "targetCompleted": self._handle_target_completed,
+            "configuredTarget": self._handle_target_configured,
+            "targetConfigured": self._handle_target_configured,
+            "actionCompleted": self._handle_action,
+            "actionExecuted": self._handle_action,
+            "testResult": self._handle_test_result,
+            "progress": self._handle_progress,
+        }
+
     # --------- Public API ---------
 
     def reset(self) -> None:
+        version = self.version
         self.__init__()
+        self.version = version + 1
 
     def parse_file(self, bep_file_path: str) -> None:
         if not os.path.exists(bep_file_path):
             raise FileNotFoundError(f"BEP file not found: {bep_file_path}")
 
         self.reset()
-        with open(bep_file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    event = json.loads(line)
-                except json.JSONDecodeError:
-                    # Skip bad lines but don’t crash the whole parse
-                    continue
-                self.events.append(event)
-                self._process_event(event)
-        
-        self.rag_processor.process_bep_data(self.events)
+        # embeddings run in the background while we parse; finish() waits for them
+        self.rag_processor.start()
+        batch: List[Dict[str, Any]] = []
+
+        # bind once: saves a global/attribute lookup per name on every line
+        loads = orjson.loads
+        decode_error = orjson.JSONDecodeError
+        process_event = self._process_event
+
+        try:
+            # orjson parses straight from bytes, so skip text decoding and per-line strip()
+            with open(bep_file_path, "rb") as f:
+                for line in _iter_jsonl_bytes(f):
+                    try:
+                        event = loads(line)
+                    except decode_error:
+                        # Skip bad lines but don’t crash the whole parse
+                        continue
+                    process_event(event)
+
+                    batch.append(event)
+                    if len(batch) >= RAG_BATCH_SIZE:
+                        self.rag_processor.submit_events(batch)
+                        batch = []
+
+            if batch:
+                self.rag_processor.submit_events(batch)
+        except BaseException:
+            # a failed parse never reaches finish(), so release the embedding pool's threads here
+            self.rag_processor.cancel()
+            raise
+        self.rag_processor.finish()
+        self.version += 1
 
     # --------- Internals ---------
 
     def _process_event(self, event: Dict[str, Any]) -> None:
         # Determine event kind by looking inside event["id"]
-        event_id = event.get("id", {})
+        event_id = event.get("id", _EMPTY)
         if not isinstance(event_id, dict):
             return
 
-        # We’ll check for known id keys and route accordingly.
-        if "targetCompleted" in event_id:
-            self._handle_target_completed(event, event_id["targetCompleted"])
-        elif "configuredTarget" in event_id or "targetConfigured" in event_id:
-            # Some Bazel versions use "configuredTarget", others "targetConfigured".
-            configured = event_id.get("configuredTarget") or event_id.get("targetConfigured")
-            self._handle_target_configured(event, configured)
-        elif "actionCompleted" in event_id or "actionExecuted" in event_id:
-            self._handle_action(event)
-        elif "testResult" in event_id:
-            self._handle_test_result(event, event_id["testResult"])
-        elif "progress" in event_id:
-            self._handle_progress(event)
-        elif "buildMetrics" in event:
-            # Sometimes buildMetrics arrive with a generic id; still try to extract.
-            self._handle_build_metrics(event)
+        # We’ll look up the id keys (usually exactly one) and route accordingly.
+        for key in event_id:
+            handler = self._dispatch.get(key)
+            if handler:
+                handler(event, event_id[key])
+                break
+        else:
+            if "buildMetrics" in event:
+                # Sometimes buildMetrics arrive with a generic id; still try to extract.
+                self._handle_build_metrics(event)
 
         # Try resource extraction on any event (no-op if nothing present).
         self._maybe_extract_resource_point(event)
@@ -177,12 +371,12 @@ class BEPParser:
         if not label:
             return
         # The details are commonly in event["completed"] with "success": true/false
-        details = event.get("completed", {}) or event.get("targetCompleted", {}) or {}
+        details = event.get("completed") or event.get("targetCompleted") or _EMPTY
         success = bool(details.get("success", False))
-        t = self.targets.get(label) or Target(label=label)
+        t = self.targets.get(label)
+        if t is None:
+            t = self.targets[label] = Target(label)
         t.status = "success" if success else "failure"
-        # keep kind/deps if already recorded earlier
-        self.targets[label] = t
 
     def _handle_target_configured(self, event: Dict[str, Any], id_payload: Dict[str, Any]) -> None:
         """
@@ -195,7 +389,9 @@ class BEPParser:
         if not label:
             return
 
-        t = self.targets.get(label) or Target(label=label)
+        t = self.targets.get(label)
+        if t is None:
+            t = self.targets[label] = Target(label)
 
         # Commonly found in event["configured"], but we’ll also probe event["targetConfigured"]
         configured_payload = event.get("configured") or event.get("targetConfigured") or {}
@@ -223,11 +419,11 @@ class BEPParser:
 
         # Assign if found
         if deps:
+            if t.dependencies is None:
+                t.dependencies = set()
             t.dependencies.update(deps)
 
-        self.targets[label] = t
-
-    def _handle_action(self, event: Dict[str, Any]) -> None:
+    def _handle_action(self, event: Dict[str, Any], id_payload: Dict[str, Any]) -> None:
         # We don’t build a full action graph here; just count them
         self.action_count += 1
 
@@ -240,7 +436,7 @@ class BEPParser:
         if not label:
             return
 
-        payload = event.get("testResult", {})
+        payload = event.get("testResult", _EMPTY)
         # Many BEP variants use "status": "PASSED"|"FAILED"|"FLAKY"|...
         status = (payload.get("status") or "").lower()
         passed = status in ("passed", "pass", "success", "ok")
@@ -253,12 +449,13 @@ class BEPParser:
         }
 
         # Optionally reflect result onto the target
-        t = self.targets.get(label) or Target(label=label)
+        t = self.targets.get(label)
+        if t is None:
+            t = self.targets[label] = Target(label)
         if t.status == "unknown":
             t.status = "success" if passed else "failure"
-        self.targets[label] = t
 
-    def _handle_progress(self, event: Dict[str, Any]) -> None:
+    def _handle_progress(self, event: Dict[str, Any], id_payload: Dict[str, Any]) -> None:
         # Some Bazel versions may stuff resource hints in a "progress" payload.
         # We don’t need to do anything special here beyond letting _maybe_extract_resource_point run.
         return
@@ -280,13 +477,15 @@ class BEPParser:
 
         If none are found, we skip the point.
         """
-        get_num = lambda x: float(x) if isinstance(x, (int, float)) else None
+        # most events (configured/completed/...) carry none of these, so bail before probing
+        if not (event.keys() & _RESOURCE_KEYS):
+            return
 
         # Timestamp: prefer timeMillis, then timestamp
         time_ms = event.get("timeMillis")
-        if not isinstance(time_ms, (int, float)):
+        if type(time_ms) not in (int, float):
             time_ms = event.get("timestamp")
-        time_ms = get_num(time_ms)
+        time_ms = _num(time_ms)
 
         # Try a few likely nests for CPU/memory
         cpu = None
@@ -294,39 +493,29 @@ class BEPParser:
 
         # progress.resourceUsage.{cpuUsage, memoryUsage}
         progress = event.get("progress")
-        if isinstance(progress, dict):
+        if type(progress) is dict:
             ru = progress.get("resourceUsage")
-            if isinstance(ru, dict):
-                cpu = cpu or get_num(ru.get("cpuUsage") or ru.get("cpu") or ru.get("cpu_utilization"))
-                mem = mem or get_num(ru.get("memoryUsage") or ru.get("memory") or ru.get("mem"))
+            if type(ru) is dict:
+                cpu = cpu or _first_num(ru, _RU_CPU_KEYS)
+                mem = mem or _first_num(ru, _RU_MEM_KEYS)
 
         # buildMetrics.memoryMetrics.{peak, highWatermark, used}
         bm = event.get("buildMetrics")
-        if isinstance(bm, dict):
+        if type(bm) is dict:
             mem_metrics = bm.get("memoryMetrics")
-            if isinstance(mem_metrics, dict):
-                mem = mem or get_num(
-                    mem_metrics.get("peak")
-                    or mem_metrics.get("highWatermark")
-                    or mem_metrics.get("used")
-                )
+            if type(mem_metrics) is dict:
+                mem = mem or _first_num(mem_metrics, _BM_MEM_KEYS)
             # timingMetrics might have CPU-ish hints (rare)
             timing = bm.get("timingMetrics")
-            if isinstance(timing, dict):
-                cpu = cpu or get_num(
-                    timing.get("cpu") or timing.get("utilization") or timing.get("processTimeMs")
-                )
+            if type(timing) is dict:
+                cpu = cpu or _first_num(timing, _BM_CPU_KEYS)
                 # If timing gives process time in ms and no timestamp, we still record.
 
         # If we found anything meaningful, store it
         if time_ms is not None or cpu is not None or mem is not None:
-            self.resource_series.append(
-                {
-                    "time": time_ms,
-                    "cpu": cpu,
-                    "memory": mem,
-                }
-            )
+            self.resource_time.append(NAN if time_ms is None else time_ms)
+            self.resource_cpu.append(NAN if cpu is None else cpu)
+            self.resource_memory.append(NAN if mem is None else mem)
 
 
 # =========
@@ -334,7 +523,9 @@ class BEPParser:
 # =========
 
 bep_parser = BEPParser()
-app = FastAPI(title="Bazel BEP Viz API", version="1.0.0")
+
+# orjson for every endpoint: faster than stdlib json, and NaN / numpy arrays serialize natively
+app = FastAPI(title="Bazel BEP Viz API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS: allow local dev frontends by default
 app.add_middleware(
@@ -357,29 +548,60 @@ async def root():
     return {"message": "Bazel BEP Viz API is running"}
 
 
+def _resample(
+    time: array, cpu: array, memory: array, bucket_ms: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Downsample the resource columns into fixed bucket_ms wide time buckets, vectorized in numpy.
+    Returns (bucket start time, mean cpu, mean memory) per non-empty bucket; points without a
+    timestamp are dropped and a bucket with no cpu/memory samples gets NaN.
+    """
+    t = np.frombuffer(time, dtype=np.float64)
+    has_time = ~np.isnan(t)
+    t = t[has_time]
+    if not t.size:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty, empty
+
+    start = t.min()
+    buckets, inverse = np.unique(((t - start) // bucket_ms).astype(np.int64), return_inverse=True)
+    inverse = inverse.ravel()
+
+    def bucket_mean(values: array) -> np.ndarray:
+        v = np.frombuffer(values, dtype=np.float64)[has_time]
+        present = ~np.isnan(v)
+        sums = np.bincount(inverse[present], weights=v[present], minlength=buckets.size)
+        counts = np.bincount(inverse[present], minlength=buckets.size)
+        with np.errstate(invalid="ignore"):
+            return sums / counts
+
+    return start + buckets * float(bucket_ms), bucket_mean(cpu), bucket_mean(memory)
+
+
 @app.get("/api/resource-usage")
-async def get_resource_usage():
+async def get_resource_usage(
+    bucket_ms: Optional[int] = Query(None, gt=0, description="Average the series into buckets of this many ms"),
+):
     """
     Returns a simple time series for resource usage. Because BEP formats vary,
     any of time/cpu/memory can be None if Bazel didn't emit them.
     """
-    # Already pre-extracted during parse; just return.
-    # To make it frontend-friendly, split into parallel arrays:
-    times: List[Optional[float]] = []
-    cpu: List[Optional[float]] = []
-    mem: List[Optional[float]] = []
+    # The columns go out as zero-copy float64 views; orjson writes NaN (a metric Bazel didn't
+    # emit) as null. Returning the response directly skips FastAPI's jsonable_encoder pass.
+    if bep_parser.resource_time and bucket_ms:
+        time, cpu, memory = _resample(
+            bep_parser.resource_time, bep_parser.resource_cpu, bep_parser.resource_memory, bucket_ms
+        )
+    else:
+        time, cpu, memory = (
+            np.frombuffer(column, dtype=np.float64)
+            for column in (bep_parser.resource_time, bep_parser.resource_cpu, bep_parser.resource_memory)
+        )
+    return ORJSONResponse({"time": time, "cpu": cpu, "memory": memory, "count": int(time.size)})
 
-    for point in bep_parser.resource_series:
-        times += [point.get("time")]
-        cpu += [point.get("cpu")]
-        mem += [point.get("memory")]
 
-    return {
-        "time": times,
-        "cpu": cpu,
-        "memory": mem,
-        "count": len(times),
-    }
+# (parser version, serialized /api/graph body); the graph only changes when a BEP file is parsed
+_graph_cache: Optional[Tuple[int, bytes]] = None
 
 
 @app.get("/api/graph")
@@ -389,48 +611,60 @@ async def get_graph():
       nodes: targets + tests
       edges: target dependency edges + test->target edges
     """
+    global _graph_cache
+    if _graph_cache is None or _graph_cache[0] != bep_parser.version:
+        _graph_cache = (bep_parser.version, orjson.dumps(_build_graph()))
+    return Response(content=_graph_cache[1], media_type="application/json")
+
+
+def _build_graph() -> Dict[str, Any]:
     nodes: List[Dict[str, Any]] = []
     edges: List[Dict[str, Any]] = []
 
-    # Helper to make DOM-safe IDs
+    targets = bep_parser.targets
+
+    # DOM-safe IDs: targets already carry theirs from parse time; only labels that never showed
+    # up as a target (e.g. a dep that wasn't configured itself) get translated here
     def safe_id(s: str) -> str:
-        return s.replace("/", "_").replace(":", "_")
+        t = targets.get(s)
+        return t.node_id if t is not None else s.translate(_SAFE_ID_TABLE)
 
     # Target nodes
-    for label, target in bep_parser.targets.items():
-        gid_parts = label.split("/")
-        group = gid_parts[1] if len(gid_parts) > 1 else "root"
+    for label, target in targets.items():
+        label_id = target.node_id
 
         nodes.append(
             {
-                "id": safe_id(label),
+                "id": label_id,
                 "originalId": label,
-                "label": label.split("/")[-1],
+                "label": target.short_label,
                 "type": "target",
                 "status": target.status,
                 "kind": target.kind,
-                "group": group,
+                "group": target.group,
             }
         )
 
         # Dependencies
-        for dep in sorted(target.dependencies):
+        for dep in sorted(target.dependencies or ()):
+            dep_id = safe_id(dep)
             edges.append(
                 {
-                    "id": f"{safe_id(label)}-{safe_id(dep)}",
-                    "source": safe_id(label),
-                    "target": safe_id(dep),
+                    "id": f"{label_id}-{dep_id}",
+                    "source": label_id,
+                    "target": dep_id,
                     "type": "dependency",
                 }
             )
 
     # Test nodes and edges to their target (same label)
     for test_label, test_data in bep_parser.test_results.items():
+        test_id = safe_id(test_label)
         nodes.append(
             {
-                "id": safe_id(test_label) + "__test",
+                "id": test_id + "__test",
                 "originalId": test_label,
-                "label": test_label.split("/")[-1],
+                "label": test_label.rpartition("/")[2],
                 "type": "test",
                 "status": "passed" if test_data.get("passed") else "failed",
                 "group": "tests",
@@ -439,9 +673,9 @@ async def get_graph():
         # Connect test node to its corresponding target node (same label)
         edges.append(
             {
-                "id": f"{safe_id(test_label)}__test->{safe_id(test_label)}",
-                "source": safe_id(test_label) + "__test",
-                "target": safe_id(test_label),
+                "id": f"{test_id}__test->{test_id}",
+                "source": test_id + "__test",
+                "target": test_id,
                 "type": "test",
             }
         )
@@ -472,7 +706,9 @@ async def query_bep(request: QueryRequest):
                 detail="No BEP data processed for RAG"
             )
 
-        response = bep_parser.rag_processor.query(request.query)
+        # retrieval + LLM call blocks for seconds; keep it off the event loop so graph and
+        # resource-usage requests are still served meanwhile
+        response = await run_in_threadpool(bep_parser.rag_processor.query, request.query)
         return{
             "query": request.query,
             "response": response
@@ -500,7 +736,7 @@ def main():
                 f"[BEP] Loaded {len(bep_parser.targets)} targets, "
                 f"{bep_parser.action_count} actions, "
                 f"{len(bep_parser.test_results)} tests, "
-                f"{len(bep_parser.resource_series)} resource points"
+                f"{len(bep_parser.resource_time)} resource points"
             )
         else:
             print(f"[WARN] BEP file not found: {path}")
@@ -2,7 +2,7 @@ import json
 import os
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple, Iterable
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,62 +16,216 @@ from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
 from dotenv import load_dotenv
 
-@dataclass
+try:
+    # orjson parses bytes directly and serializes straight to bytes
+    from orjson import dumps as _dumps, loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+    def _dumps(obj: Any) -> bytes:  # type: ignore[misc]
+        return json.dumps(obj).encode("utf-8")
+
+# top-level keys that can hold a resource point; see maybe_extract_resource_point
+_RESOURCE_KEYS = frozenset(("progress", "buildMetrics", "timeMillis", "timestamp"))
+
+# BEP JSON only ever decodes to builtin types, so the resource probes compare type() directly
+# instead of paying for isinstance's subclass check (this also keeps bools out of the series)
+def _num(x: Any) -> Optional[float]:
+    return float(x) if type(x) in (int, float) else None
+
+
+# fallback key lists for the resource fields, in order of preference
+_RU_CPU_KEYS = ("cpuUsage", "cpu", "cpu_utilization")
+_RU_MEM_KEYS = ("memoryUsage", "memory", "mem")
+_BM_MEM_KEYS = ("peak", "highWatermark", "used")
+_BM_CPU_KEYS = ("cpu", "utilization", "processTimeMs")
+
+
+def _first_num(d: Dict[str, Any], keys: Tuple[str, ...]) -> Optional[float]:
+    # _num(d.get(k1) or d.get(k2) or ...): the first truthy value wins, so a 0 or a missing key
+    # falls through to the next one
+    for k in keys:
+        v = d.get(k)
+        if v:
+            return _num(v)
+    return None
+
+# "/" and ":" can be problematic for some graph visualization libraries; swap both in one pass
+_SAFE_ID_TABLE = str.maketrans("/:", "__")
+
+# a line that contains none of these quoted keys can't reach a handler or carry a resource point,
+# so parse_stream drops it before paying for a full JSON parse (bytes `in` is a C substring search)
+_INTEREST_KEYS = (
+    b'"targetCompleted"',
+    b'"configuredTarget"',
+    b'"targetConfigured"',
+    b'"actionCompleted"',
+    b'"actionExecuted"',
+    b'"testResult"',
+    b'"progress"',
+    b'"buildMetrics"',
+    b'"timeMillis"',
+    b'"timestamp"',
+)
+
+# shared read-only default for missing payloads, so lookups don't build a fresh {} per event.
+# Never mutate it.
+_EMPTY: Dict[str, Any] = {}
+
+def _iter_jsonl_bytes(fp: Any, bufsize: int = 1 << 20) -> Iterator[bytes]:
+    # Yield the non-empty lines of a binary JSONL stream (anything with read(n) -> bytes), without
+    # the newline. Each bufsize chunk is split with a single C-level splitlines() call; a partial
+    # last line is carried over into the next chunk.
+    tail = b""
+    while True:
+        chunk = fp.read(bufsize)
+        if not chunk:
+            break
+        buf = tail + chunk if tail else chunk
+        lines = buf.splitlines()
+        # unless the chunk ended exactly on a newline, its last line is still incomplete
+        tail = b"" if buf.endswith(b"\n") else lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if tail:
+        yield tail
+
+class _S3ObjectReader:
+    # File-like read(n) over an s3 object. If the body stream drops part way, the download resumes
+    # from the last byte handed out with a ranged GET (pinned to the same ETag) instead of failing
+    # the whole parse.
+    def __init__(self, s3_client: Any, bucket: str, key: str, max_retries: int = 3) -> None:
+        # import here: only callers that already hold an s3 client need botocore
+        from botocore.exceptions import BotoCoreError
+
+        self._errors = BotoCoreError
+        self._s3 = s3_client
+        self._bucket = bucket
+        self._key = key
+        self._max_retries = max_retries
+        self._offset = 0
+
+        obj = s3_client.get_object(Bucket=bucket, Key=key)
+        self._etag = obj["ETag"]
+        # the body is a file-like handle that only starts downloading when we read from it
+        self._body = obj["Body"]
+
+    def read(self, size: int = -1) -> bytes:
+        retries = 0
+        while True:
+            try:
+                chunk = self._body.read(size)
+            except self._errors:
+                if retries >= self._max_retries:
+                    raise
+                retries += 1
+                self._body.close()
+                self._body = self._s3.get_object(
+                    Bucket=self._bucket,
+                    Key=self._key,
+                    Range=f"bytes={self._offset}-",
+                    IfMatch=self._etag,
+                )["Body"]
+                continue
+            self._offset += len(chunk)
+            return chunk
+
+    def close(self) -> None:
+        self._body.close()
+
+
+# slots: no per-instance __dict__
+@dataclass(slots=True)
 class Target:
     label: str
     status: str = "unknown"           # "unknown" | "success" | "failure"
     kind: Optional[str] = None
-    dependencies: Set[str] = field(default_factory=set)
+    # appended as configured events arrive (duplicates and all); export_graph dedupes once
+    dependencies: List[str] = field(default_factory=list)
 
 class BEPParser:
     def __init__(self) -> None:
-        self.events: List[Dict[str, Any]] = []
-
         self.targets: Dict[str, Target] = {}
         self.test_results: Dict[str, Dict[str, Any]] = {}
         self.action_count: int = 0
-
-        self.resource_series: List[Dict[str, Optional[float]]] = []
+        # kept up to date by the handlers so the summary doesn't rescan targets/tests
+        self.failed_targets: Set[str] = set()
+        self.failed_tests: Set[str] = set()
+
+        # resource samples as parallel columns (one entry per point) so the export needs no transpose
+        self._times: List[Optional[float]] = []
+        self._cpu: List[Optional[float]] = []
+        self._mem: List[Optional[float]] = []
         # self.rag_processor = BEPRAGProcessor()
 
+        # event["id"] key -> handler(event, id_payload); process_event looks up the id's own keys
+        # (usually exactly one) here instead of probing the id once per known key.
+        self._handlers: Dict[str, Callable[[Dict[str, Any], Dict[str, Any]], None]] = {
+            "targetCompleted": self.handle_target_completed,
+            "configuredTarget": self.handle_target_configured,
+            "targetConfigured": self.handle_target_configured,
+            "actionCompleted": self.handle_action,
+            "actionExecuted": self.handle_action,
+            "testResult": self.handle_test_result,
+            "progress": self.handle_progress,
+        }
 
-    def parse_stream(self, lines: Iterable[str]) -> None:
+
+    def parse_stream(self, lines: Iterable[bytes]) -> None:
         self.reset()
 
-        for raw_line in lines:
-            line = raw_line.strip()
+        # bind once: saves a global/attribute lookup per name on every line
+        loads = _loads
+        process_event = self.process_event
+        interest_keys = _INTEREST_KEYS
+
+        for line in lines:
+            # orjson parses the raw bytes directly and ignores surrounding whitespace,
+            # so there is no decode() or strip() per line
             if not line:
                 continue
-            try:
-                event = json.loads(line)
-            except json.JSONDecodeError:
+            if not any(key in line for key in interest_keys):
                 continue
-            self.events.append(event)
             try:
-                self.process_event(event)
+                event = loads(line)
+            except ValueError:
+                # not valid utf-8 (or not JSON at all); retry the latin-1 text before giving up
+                try:
+                    event = loads(line.decode("latin-1"))
+                except ValueError:
+                    continue
+            try:
+                process_event(event)
             except Exception:
                 continue
 
+    def parse_s3(self, s3_client: Any, bucket: str, key: str) -> None:
+        # Stream the JSONL object from s3 straight into parse_stream, so events are parsed while
+        # the body is still downloading instead of going through a temp file first.
+        body = _S3ObjectReader(s3_client, bucket, key)
+        try:
+            # raw byte lines go to parse_stream as they are; no text decoding
+            self.parse_stream(_iter_jsonl_bytes(body))
+        finally:
+            body.close()
+
     def process_event(self, event: Dict[str, Any]) -> None:
         # check if event id is a dictionary. If not, we cannot reliable process as of now.
-        event_id = event.get("id", {})
+        event_id = event.get("id", _EMPTY)
         if not isinstance(event_id, dict):
             return
         
-        # Checking for known id keys and route appropriately
-        if "targetCompleted" in event_id:
-            self.handle_target_completed(event, event_id["targetCompleted"])
-        elif "configuredTarget" in event_id or "targetConfigured" in event_id:
-            configured = event_id.get("configuredTarget") or event_id.get("targetConfigured")
-            self.handle_target_configured(event, configured)
-        elif "actionCompleted" in event_id or "actionExecuted" in event_id:
-            self.handle_action(event)
-        elif "testResult" in event_id:
-            self.handle_test_result(event, event_id["testResult"])
-        elif "progress" in event_id:
-            self.handle_progress(event)
-        elif "buildMetrics" in event:
-            self.handle_build_metrics(event)
+        # Checking for known id keys and route appropriately: one table lookup per id key
+        handlers = self._handlers
+        for key, payload in event_id.items():
+            handler = handlers.get(key)
+            if handler is not None and payload is not None:
+                handler(event, payload)
+                break
+        else:
+            if "buildMetrics" in event:
+                self.handle_build_metrics(event)
 
         self.maybe_extract_resource_point(event)
 
@@ -80,11 +234,17 @@ class BEPParser:
         label = id_payload.get("label")
         if not label:
             return
-        details = event.get("completed", {}) or event.get("targetCompleted", {}) or {}
+        details = event.get("completed") or event.get("targetCompleted") or _EMPTY
         success = bool(details.get("success", False))
-        t = self.targets.get(label)  or Target(label=label)
-        t.status = "success" if success else "failure"
-        self.targets[label] = t
+        t = self.targets.get(label)
+        if t is None:
+            t = self.targets[label] = Target(label)
+        if success:
+            t.status = "success"
+            self.failed_targets.discard(label)
+        else:
+            t.status = "failure"
+            self.failed_targets.add(label)
 
 
     def handle_target_configured(self, event: Dict[str, Any], id_payload: Dict[str, Any]) -> None:
@@ -92,29 +252,26 @@ class BEPParser:
         if not label:
             return
         
-        t = self.targets.get(label) or Target(label = label)
+        t = self.targets.get(label)
+        if t is None:
+            t = self.targets[label] = Target(label)
 
-        configured_payload = event.get("targetKind") or configured_payload.get("kind")
+        configured_payload = event.get("configured") or event.get("targetConfigured") or _EMPTY
         kind = configured_payload.get("targetKind") or configured_payload.get("kind")
         if kind:
             t.kind = kind
 
-        deps = set()
+        deps = t.dependencies
 
         for key in ("deps", "dependencies"):
             value = configured_payload.get(key)
             if isinstance(value, list):
                 for v in value:
                     if isinstance(v, dict) and "label" in v:
-                        deps.add(v["label"])
-        
-        if deps:
-            t.dependencies.update(deps)
-
-        self.targets[label] = t
+                        deps.append(v["label"])
 
 
-    def handle_action(self, event: Dict[str, Any]) -> None:
+    def handle_action(self, event: Dict[str, Any], id_payload: Dict[str, Any]) -> None:
         self.action_count += 1
 
     
@@ -123,24 +280,34 @@ class BEPParser:
         if not label:
             return
         
-        payload = event.get("testResult", {})
+        payload = event.get("testResult", _EMPTY)
         status = (payload.get("status") or "").lower()
         passed = status in ("passed", "pass", "success", "ok")
 
-        self.test_result[label] = {
+        self.test_results[label] = {
             "status": status,
             "passed": passed,
             "run": payload.get("run", 0),
             "attempt": payload.get("attempt", 0),
         }
-
-        t = self.targets.get(label) or Target(label=label)
+        # the latest attempt wins, same as test_results
+        if passed:
+            self.failed_tests.discard(label)
+        else:
+            self.failed_tests.add(label)
+
+        t = self.targets.get(label)
+        if t is None:
+            t = self.targets[label] = Target(label)
         if t.status == "unknown":
-            t.status = "success" if passed else "failure"
-        self.targets[label] = t
+            if passed:
+                t.status = "success"
+            else:
+                t.status = "failure"
+                self.failed_targets.add(label)
 
     
-    def handle_progress(self, event: Dict[str, Any]) -> None:
+    def handle_progress(self, event: Dict[str, Any], id_payload: Dict[str, Any]) -> None:
         # perform no direct action for the progress since our maybe_extract_resource_point handles
         # progress and metrics
         return
@@ -161,72 +328,55 @@ class BEPParser:
 
         If none are found, we skip the point.
         """
-        get_num = lambda x: float(x) if isinstance(x, (int, float)) else None
+        # most events (configured/completed/...) carry none of these, so bail before probing
+        if not (event.keys() & _RESOURCE_KEYS):
+            return
 
         # Timestamp: prefer timeMillis, then timestamp
         time_ms = event.get("timeMillis")
-        if not isinstance(time_ms, (int, float)):
+        if type(time_ms) not in (int, float):
             time_ms = event.get("timestamp")
-        time_ms = get_num(time_ms)
+        time_ms = _num(time_ms)
 
         # Try a few likely nests for CPU/memory
-        cpu = None
-        mem = None
+        cpu: Optional[float] = None
+        mem: Optional[float] = None
 
         # progress.resourceUsage.{cpuUsage, memoryUsage}
         progress = event.get("progress")
-        if isinstance(progress, dict):
+        if type(progress) is dict:
             ru = progress.get("resourceUsage")
-            if isinstance(ru, dict):
-                cpu = cpu or get_num(ru.get("cpuUsage") or ru.get("cpu") or ru.get("cpu_utilization"))
-                mem = mem or get_num(ru.get("memoryUsage") or ru.get("memory") or ru.get("mem"))
+            if type(ru) is dict:
+                cpu = cpu or _first_num(ru, _RU_CPU_KEYS)
+                mem = mem or _first_num(ru, _RU_MEM_KEYS)
 
         # buildMetrics.memoryMetrics.{peak, highWatermark, used}
         bm = event.get("buildMetrics")
-        if isinstance(bm, dict):
+        if type(bm) is dict:
             mem_metrics = bm.get("memoryMetrics")
-            if isinstance(mem_metrics, dict):
-                mem = mem or get_num(
-                    mem_metrics.get("peak")
-                    or mem_metrics.get("highWatermark")
-                    or mem_metrics.get("used")
-                )
+            if type(mem_metrics) is dict:
+                mem = mem or _first_num(mem_metrics, _BM_MEM_KEYS)
             # timingMetrics might have CPU-ish hints (rare)
             timing = bm.get("timingMetrics")
-            if isinstance(timing, dict):
-                cpu = cpu or get_num(
-                    timing.get("cpu") or timing.get("utilization") or timing.get("processTimeMs")
-                )
+            if type(timing) is dict:
+                cpu = cpu or _first_num(timing, _BM_CPU_KEYS)
                 # If timing gives process time in ms and no timestamp, we still record.
 
         # If we found anything meaningful, store it
         if time_ms is not None or cpu is not None or mem is not None:
-            self.resource_series.append(
-                {
-                    "time": time_ms,
-                    "cpu": cpu,
-                    "memory": mem,
-                }
-            )
+            self._times.append(time_ms)
+            self._cpu.append(cpu)
+            self._mem.append(mem)
     
     def export_resource_usage(self) -> bytes:
-        times: List[Optional[float]] = []
-        cpu: List[Optional[float]] = []
-        mem: List[Optional[float]] = []
-
-        for point in self.resource_series:
-            times.append(point.get("time"))
-            cpu.append(point.get("cpu"))
-            mem.append(point.get("memory"))
-
         payload = {
-            "time": times,
-            "cpu" : cpu,
-            "memory": mem,
-            "count": len(times),
+            "time": self._times,
+            "cpu" : self._cpu,
+            "memory": self._mem,
+            "count": len(self._times),
         }
 
-        return json.dumps(payload).encode("utf-8")
+        return _dumps(payload)
     
     # Dependency graph
     def export_graph(self) -> bytes:
@@ -235,34 +385,38 @@ class BEPParser:
 
         # replace the "/" and ":" with "_" that can be problematic for some graph visualization libraries.
         def safe_id(s: str) -> str:
-            return s.replace("/", "_").replace(":", "_")
+            return s.translate(_SAFE_ID_TABLE)
         
         # Target nodes
         for label, target in self.targets.items():
+            # one translate and one split per target, reused for the node and all of its edges
+            sid = safe_id(label)
             gid_parts = label.split("/")
             group = gid_parts[1] if len(gid_parts) > 1 else "root"
 
             nodes.append({
-                "id": safe_id(label),
+                "id": sid,
                 "originalId": label,
-                "label": label.split("/")[-1],
+                "label": gid_parts[-1],
                 "type": "target",
                 "status": target.status,
                 "kind": target.kind,
                 "group": group,
             })
 
-            for dep in sorted(target.dependencies):
+            for dep in sorted(set(target.dependencies)):
+                dep_id = safe_id(dep)
                 edges.append({
-                    "id": f"{safe_id(label)}-{safe_id(dep)}",
-                    "source": safe_id(dep),
-                    "target": safe_id(label),
+                    "id": f"{sid}-{dep_id}",
+                    "source": dep_id,
+                    "target": sid,
                     "type": "dependency",
                 })
         
         for test_label, test_data in self.test_results.items():
+            sid = safe_id(test_label)
             nodes.append({
-                "id": safe_id(test_label) + "__test",
+                "id": sid + "__test",
                 "originalId": test_label,
                 "label": test_label.split("/")[-1],
                 "type": "test",
@@ -271,9 +425,9 @@ class BEPParser:
             })
 
             edges.append({
-                "id": f"{safe_id(test_label)}__test->{safe_id(test_label)}",
-                "source": safe_id(test_label) + "__test",
-                "target": safe_id(test_label),
+                "id": f"{sid}__test->{sid}",
+                "source": sid + "__test",
+                "target": sid,
                 "type": "test",
             })
         
@@ -288,14 +442,17 @@ class BEPParser:
             }
         }
 
-        return json.dumps(payload).encode("utf-8")
+        return _dumps(payload)
 
 
     def export_summary(self) -> bytes:
         payload = {
             "targets": len(self.targets),
             "tests": len(self.test_results),
+            "failed_targets": len(self.failed_targets),
+            "failed_tests": len(self.failed_tests),
+            "passed_tests": len(self.test_results) - len(self.failed_tests),
             "actions": self.action_count,
-            "has_resource_usage": len(self.resource_series) > 0,
+            "has_resource_usage": len(self._times) > 0,
         }
-        return json.dumps(payload).encode("utf-8")
\ No newline at end of file
+        return _dumps(payload)
\ No newline at end of file
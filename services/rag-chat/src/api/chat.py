@@ -1,4 +1,6 @@
+import json
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 from services.rag_engine import RAGEngine
@@ -11,6 +13,7 @@ class QueryRequest(BaseModel):
     query: str
     file_id: Optional[str] = None
     session_id: Optional[str] = None
+    sub_queries: Optional[List[str]] = None    # extra retrieval queries, searched concurrently
 
 class QueryResponse(BaseModel):
     response: str
@@ -28,14 +31,35 @@ async def query_build(request:QueryRequest):
         result = await rag_engine.query(
             query = request.query,
             file_id = request.file_id,
-            session_id = request.session_id
+            session_id = request.session_id,
+            sub_queries = request.sub_queries,
         )
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# Same as /query, but streams the answer as server-sent events while the LLM generates it:
+# "meta" (session_id, sources), then one "token" event per chunk, then "done".
+@router.post("/query/stream")
+async def stream_query_build(request: QueryRequest):
+    async def events():
+        try:
+            async for event, data in rag_engine.stream_query(
+                query = request.query,
+                file_id = request.file_id,
+                session_id = request.session_id,
+                sub_queries = request.sub_queries,
+            ):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            # headers are already sent, so report the failure in-band
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
     
     
 @router.delete("/session/{session_id}")
 async def clear_session(session_id: str):
-    rag_engine.clear_session(session_id)
+    await rag_engine.clear_session(session_id)
     return {"status" : "cleared"}
\ No newline at end of file
@@ -4,7 +4,7 @@ load_dotenv()
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api.chat import router as chat_router
+from api.chat import router as chat_router, rag_engine
 
 app = FastAPI(title="RAG Chat Service", version="1.0.0")
 
@@ -18,6 +18,10 @@ app.add_middleware(
 
 app.include_router(chat_router)
 
+@app.on_event("shutdown")
+async def _close_rag_engine():
+    await rag_engine.close()
+
 @app.get("/health")
 async def health():
     return {"status" : "ok"}
\ No newline at end of file
@@ -1,85 +1,239 @@
+import asyncio
 import os
-import uuid
-from typing import Optional, Dict, List
+import secrets
+from typing import Any, AsyncIterator, Optional, List, Tuple
+from urllib.parse import urlsplit
 
-from langchain_openai import ChatOpenAI
+import redis
+from cachetools import TTLCache
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_classic.memory import ConversationBufferWindowMemory
-from langchain_classic.chains import ConversationalRetrievalChain
 from langchain_classic.schema import Document
-from langchain_community.vectorstores import Weaviate
+from langchain_community.chat_message_histories import RedisChatMessageHistory
+from langchain_core.messages import get_buffer_string
 import weaviate
+from weaviate.classes.query import Filter
+
+# documents retrieved per query
+RETRIEVAL_K = 4
+
+# searches go over gRPC (weaviate client v4); REST is only used for connection setup/metadata
+WEAVIATE_URL = os.getenv("WEAVIATE_URL", "http://localhost:8080")
+WEAVIATE_GRPC_PORT = int(os.getenv("WEAVIATE_GRPC_PORT", "50051"))
+
+# query embeddings are reused for repeated questions instead of paying another embeddings call
+EMBED_CACHE_SIZE = 10_000
+EMBED_TTL_SECONDS = 60 * 60
+
+# chat history lives in redis so any worker/replica can serve any session; a session that goes
+# quiet for SESSION_TTL_SECONDS expires there. Each process keeps a bounded cache of memory
+# wrappers that also ages entries out after the same TTL.
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_TTL_SECONDS = 60 * 60
+SESSION_CACHE_SIZE = 1024
+
+# same wording as langchain's ConversationalRetrievalChain defaults, which this replaces
+CONDENSE_QUESTION_PROMPT = (
+    "Given the following conversation and a follow up question, rephrase the follow up question "
+    "to be a standalone question, in its original language.\n\n"
+    "Chat History:\n{chat_history}\nFollow Up Input: {question}\nStandalone question:"
+)
+ANSWER_SYSTEM_PROMPT = (
+    "Use the following pieces of context to answer the user's question. \n"
+    "If you don't know the answer, just say that you don't know, don't try to make up an answer.\n"
+    "----------------\n{context}"
+)
+
+class _RedisHistory(RedisChatMessageHistory):
+    # RedisChatMessageHistory(url=...) builds its own client and connection pool per instance;
+    # this runs on the engine's shared client instead
+    def __init__(self, session_id: str, redis_client: redis.Redis, ttl: Optional[int] = None):
+        self.redis_client = redis_client
+        self.session_id = session_id
+        self.key_prefix = "message_store:"
+        self.ttl = ttl
+
 
 class RAGEngine:
     def __init__(self):
         self.llm = ChatOpenAI(openai_api_key = os.getenv("OPENAI_API_KEY"), model = "gpt-4o-mini", temperature = 0.1)
+        # same embedding model the celery worker stores the documents with
+        self.embeddings = OpenAIEmbeddings(openai_api_key = os.getenv("OPENAI_API_KEY"))
+        self._embed_cache: "TTLCache[str, List[float]]" = TTLCache(maxsize=EMBED_CACHE_SIZE, ttl=EMBED_TTL_SECONDS)
+
+        self.sessions: "TTLCache[str, ConversationBufferWindowMemory]" = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL_SECONDS)
+        # one connection pool for every session's history (used from worker threads, see _condense)
+        self._redis = redis.Redis.from_url(REDIS_URL)
+
+        # connected on first file-scoped query rather than at import, so the service starts (and
+        # general questions work) even while weaviate is still coming up
+        self._weaviate_client: Optional[weaviate.WeaviateAsyncClient] = None
+        self._weaviate_lock = asyncio.Lock()
 
-        self.sessions: Dict[str, ConversationBufferWindowMemory] = {}
+    async def _get_documents(self):
+        # the shared "Document" collection on one long-lived async client; its gRPC channel
+        # multiplexes every search over a single HTTP/2 connection
+        if self._weaviate_client is None:
+            async with self._weaviate_lock:
+                if self._weaviate_client is None:
+                    url = urlsplit(WEAVIATE_URL)
+                    client = weaviate.use_async_with_custom(
+                        http_host = url.hostname,
+                        http_port = url.port or (443 if url.scheme == "https" else 80),
+                        http_secure = url.scheme == "https",
+                        grpc_host = url.hostname,
+                        grpc_port = WEAVIATE_GRPC_PORT,
+                        grpc_secure = url.scheme == "https",
+                    )
+                    try:
+                        await client.connect()
+                    except Exception:
+                        # don't leave the channel open; the next query tries again with a new client
+                        await client.close()
+                        raise
+                    self._weaviate_client = client
+        return self._weaviate_client.collections.get("Document")
 
-        self.weaviate_client = weaviate.Client(url=os.getenv("WEAVIATE_URL", "http://localhost:8080"))
+    async def close(self):
+        if self._weaviate_client is not None:
+            await self._weaviate_client.close()
+            self._weaviate_client = None
+        self._redis.close()
+
+    async def _embed(self, query: str) -> List[float]:
+        key = " ".join(query.split())
+        vector = self._embed_cache.get(key)
+        if vector is None:
+            vector = self._embed_cache[key] = await self.embeddings.aembed_query(key)
+        return vector
 
     def _get_or_create_session(self, session_id: Optional[str]) -> tuple[str, ConversationBufferWindowMemory]:
         if not session_id:
-            session_id = uuid.uuid4().hex
-        if session_id not in self.sessions:
-            self.sessions[session_id] = ConversationBufferWindowMemory(
-                memory_key = "chat_history",
-                return_messages = True,
-                k = 10
-            )
-        return session_id, self.sessions[session_id]
+            session_id = secrets.token_hex(16)
+        memory = self.sessions.get(session_id)
+        if memory is not None:
+            return session_id, memory
+
+        # TTLCache evicts the least recently used entry itself once maxsize is reached
+        memory = self.sessions[session_id] = ConversationBufferWindowMemory(
+            chat_memory = _RedisHistory(session_id, self._redis, ttl=SESSION_TTL_SECONDS),
+            memory_key = "chat_history",
+            return_messages = True,
+            k = 10
+        )
+        return session_id, memory
     
-    async def query(self, query: str, file_id: Optional[str], session_id: Optional[str]) -> dict:
+    async def query(self, query: str, file_id: Optional[str], session_id: Optional[str], sub_queries: Optional[List[str]] = None) -> dict:
+        # sub_queries: extra retrieval queries (e.g. from decomposing the question); their
+        # documents are pooled with the main query's as context
         session_id, memory = self._get_or_create_session(session_id)
+        messages, sources = await self._build_messages(query, file_id, memory, sub_queries)
 
-        # getting retriever for file
-        retriever = None
+        response = await self.llm.ainvoke(messages)
+        answer = response.content
+        if sources is not None:
+            await asyncio.to_thread(memory.save_context, {"question": query}, {"answer": answer})
+
+        return {
+            "response": answer,
+            "sources": sources,
+            "session_id": session_id
+        }
+
+    async def stream_query(self, query: str, file_id: Optional[str], session_id: Optional[str], sub_queries: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, Any]]:
+        # same as query(), but yields ("meta", {session_id, sources}) once retrieval is done, then
+        # ("token", text) for every chunk the LLM produces, and finally ("done", None)
+        session_id, memory = self._get_or_create_session(session_id)
+        messages, sources = await self._build_messages(query, file_id, memory, sub_queries)
+        yield "meta", {"session_id": session_id, "sources": sources}
+
+        parts = []
+        async for chunk in self.llm.astream(messages):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield "token", chunk.content
+        if sources is not None:
+            await asyncio.to_thread(memory.save_context, {"question": query}, {"answer": "".join(parts)})
+        yield "done", None
+
+    async def _build_messages(self, query: str, file_id: Optional[str], memory: ConversationBufferWindowMemory, sub_queries: Optional[List[str]]) -> Tuple[List[dict], Optional[List[str]]]:
+        # LLM messages for the answer, plus the source types used (None for a general question)
+        # getting the document collection for file-scoped questions
+        documents = None
         if file_id:
             try:
-                vectorstore = Weaviate(
-                    client=self.weaviate_client,
-                    class_name="Document",
-                    text_key="text"
-                )
-                # Filter to only retrieve objects with the correct file_id
-                retriever = vectorstore.as_retriever(
-                    search_kwargs={
-                        "k": 4,
-                        "filters": {
-                            "file_id": file_id
-                        }
-                    }
-                )
+                documents = await self._get_documents()
             except Exception:
-                retriever = None
-
-        if not retriever:
-            response = await self._general_query(query)
-            return {"response": response, "sources": None, "session_id": session_id}
-        
-        chain = ConversationalRetrievalChain.from_llm(
-            llm = self.llm,
-            retriever = retriever,
-            memory = memory,
-            return_source_documents = True
-        )
+                documents = None
 
-        result = chain.invoke({"question": query})
-        sources = [doc.metadata.get("type") for doc in result.get("source_documents", [])]
+        if documents is None:
+            return self._general_messages(query), None
 
-        return {
-            "response": result["answer"],
-            "sources": list(set(sources)),
-            "session_id": session_id
-        }
+        # Rewriting the follow-up into a standalone question and retrieval are both network round
+        # trips, so they run concurrently. Retrieval uses the raw query: a file only has its
+        # summary, graph and resource_usage documents, and k=4 returns all of them either way.
+        question, docs = await asyncio.gather(
+            self._condense(query, memory),
+            self._retrieve_many(documents, file_id, [query, *(sub_queries or [])]),
+        )
 
-    async def _general_query(self, query: str) -> str:
+        context = "\n\n".join(doc.page_content for doc in docs)
         messages = [
+            {"role": "system", "content": ANSWER_SYSTEM_PROMPT.format(context=context)},
+            {"role": "user", "content": question},
+        ]
+        # distinct source types in retrieval order; hits without a type are left out
+        sources = list(dict.fromkeys(t for t in (doc.metadata.get("type") for doc in docs) if t))
+        return messages, sources
+
+    async def _retrieve(self, documents, file_id: str, query: str) -> List[Document]:
+        # embed (or reuse the cached vector), then a nearVector search over this file's documents
+        vector = await self._embed(query)
+        response = await documents.query.near_vector(
+            near_vector = vector,
+            limit = RETRIEVAL_K,
+            # Filter to only retrieve objects with the correct file_id
+            filters = Filter.by_property("file_id").equal(file_id),
+            return_properties = ["text", "type"],
+        )
+        return [
+            Document(page_content=obj.properties.get("text") or "", metadata={"type": obj.properties.get("type")})
+            for obj in response.objects
+        ]
+
+    async def _retrieve_many(self, documents, file_id: str, queries: List[str]) -> List[Document]:
+        # one search per query, all in flight at once instead of one round trip after another;
+        # documents found by several queries are kept once, in first-seen order
+        if len(queries) == 1:
+            return await self._retrieve(documents, file_id, queries[0])
+        results = await asyncio.gather(*(self._retrieve(documents, file_id, q) for q in queries))
+        seen = set()
+        docs = []
+        for doc in (d for result in results for d in result):
+            key = (doc.page_content, doc.metadata.get("type"))
+            if key not in seen:
+                seen.add(key)
+                docs.append(doc)
+        return docs
+
+    async def _condense(self, query: str, memory: ConversationBufferWindowMemory) -> str:
+        # RedisChatMessageHistory is synchronous, so its redis reads run off the event loop.
+        # First turn of a session: nothing to condense, no LLM call
+        history = (await asyncio.to_thread(memory.load_memory_variables, {}))["chat_history"]
+        if not history:
+            return query
+        response = await self.llm.ainvoke(
+            CONDENSE_QUESTION_PROMPT.format(chat_history=get_buffer_string(history), question=query)
+        )
+        return response.content
+
+    def _general_messages(self, query: str) -> List[dict]:
+        return [
             {"role": "system", "content": "You are a Bazel Build analysis assistant. Help users understand Bazel Builds, BEP files, dependencies, and optimization strategies"},
             {"role": "user", "content": query}
         ]
-        response = self.llm.invoke(messages)
-        return response.content
 
-    def clear_session(self, session_id: str):
-        if session_id in self.sessions:
-            del self.sessions[session_id]
\ No newline at end of file
+    async def clear_session(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        # the history may have been written by another worker, so clear it in redis directly
+        await asyncio.to_thread(_RedisHistory(session_id, self._redis).clear)
\ No newline at end of file
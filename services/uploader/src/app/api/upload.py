@@ -1,10 +1,19 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status
 from pydantic import BaseModel, Field
-import uuid
+import logging
+import secrets
 
 # Import the celery_app instance from the main application file
 from app.celery_app import app
-from app.core.s3 import generate_presigned_post, object_exists, generate_presigned_get
+from app.core.s3 import (
+    generate_presigned_post,
+    object_exists,
+    generate_presigned_get,
+    create_multipart_upload,
+    complete_multipart_upload,
+    abort_multipart_upload,
+    MULTIPART_THRESHOLD,
+)
 from app.core.config import settings
 from app.models.uploads import(
     create_upload_record,
@@ -14,8 +23,11 @@ from app.models.uploads import(
 )
 
 router = APIRouter(prefix="/upload", tags=["upload"])
+log = logging.getLogger(__name__)
 
 # Request and Response schemas
+# (responses are filled from values the handlers produce themselves, so they are built with
+# model_construct and skip a validation pass; requests are still validated as usual)
 
 class InitUploadRequest(BaseModel):
     filename: str = Field(..., description="Original filename")
@@ -25,12 +37,21 @@ class InitUploadRequest(BaseModel):
 
 class InitUploadResponse(BaseModel):
     file_id: str
-    url: str        # s3 POST URL
-    fields: dict    # form fields that must be sent with the file
+    url: str | None = None          # s3 POST URL
+    fields: dict | None = None      # form fields that must be sent with the file
+    # only for files above MULTIPART_THRESHOLD: the client PUTs each part_size slice to its url
+    upload_id: str | None = None
+    part_size: int | None = None
+    part_urls: list[str] | None = None
     expires_in: int
 
+class CompletedPart(BaseModel):
+    part_number: int
+    etag: str       # ETag header returned by s3 for the part PUT
+
 class CompleteUploadRequest(BaseModel):
     file_id: str
+    parts: list[CompletedPart] | None = None    # required for multipart uploads
 
 class UploadStatusResponse(BaseModel):
     file_id: str
@@ -49,7 +70,9 @@ class ArtifactURLsResponse(BaseModel):
 @router.post("/init", response_model=InitUploadResponse, status_code=status.HTTP_201_CREATED)
 async def init_upload(req: InitUploadRequest):
     # Some validation we perform
-    max_size = 20_000_000     # 20MB
+    # BEP files of large builds run into hundreds of MB; the worker streams them from s3, so the
+    # limit is about what we accept to store, not what fits in memory
+    max_size = 500_000_000     # 500MB
     if req.size > max_size:
         raise HTTPException(status_code=413, detail="File too large")
     
@@ -59,11 +82,36 @@ async def init_upload(req: InitUploadRequest):
             status_code=415, detail=f"Unsupported content type: {req.content_type}"
         )
     
-    file_id = uuid.uuid4().hex
+    file_id = secrets.token_hex(16)
     # Late we can include user_id here once we set up the auth
     # s3_key = f"bep-files/{user_id}/{file_id}.json"
     s3_key = f"bep-files/{file_id}.json"
 
+    # Large files are sent straight to s3 in parts, smaller ones with a single presigned POST
+    if req.size > MULTIPART_THRESHOLD:
+        multipart = await create_multipart_upload(
+            key=s3_key,
+            content_type=req.content_type,
+            size=req.size,
+        )
+
+        create_upload_record(
+            file_id=file_id,
+            s3_key=s3_key,
+            original_filename=req.filename,
+            content_type = req.content_type,
+            max_size = max_size,
+            multipart_upload_id = multipart["upload_id"],
+            )
+
+        return InitUploadResponse.model_construct(
+            file_id = file_id,
+            upload_id = multipart["upload_id"],
+            part_size = multipart["part_size"],
+            part_urls = multipart["part_urls"],
+            expires_in = multipart["expires_in"],
+        )
+
     presigned = generate_presigned_post(
         Key=s3_key,
         content_type=req.content_type,
@@ -82,32 +130,63 @@ async def init_upload(req: InitUploadRequest):
     
     
 
-    return InitUploadResponse(
+    return InitUploadResponse.model_construct(
         file_id = file_id,
         url = presigned["url"],
         fields = presigned["fields"],
         expires_in = 300,
     )
 
+def _enqueue_processing(file_id: str, s3_key: str) -> None:
+    # The task "src.tasks.tasks.process_bep_file" is discovered by the celery-worker.
+    try:
+        taskRes = app.send_task(
+            "process_bep_file",
+            args=[file_id, s3_key],
+        )
+    except Exception as e:
+        # the client already got its 202, so record the failure where /status will show it
+        update_upload_status(file_id, UploadStatus.FAILED, error_message=f"Could not queue processing: {e}")
+        raise
+    log.debug("queued process_bep_file for %s as task %s", file_id, taskRes.id)
+
+
 # when client says upload is done, we will assign Celery job
 @router.post("/complete", status_code=status.HTTP_202_ACCEPTED)
-async def complete_upload(req: CompleteUploadRequest):
+async def complete_upload(req: CompleteUploadRequest, background_tasks: BackgroundTasks):
     record = get_upload_record(req.file_id)
     if not record:
         raise HTTPException(status_code = 404, detail = "Unknown file_id")
-    
-    # Verify that the file has been actually uploaded in s3
-    if not object_exists(record.s3_key):
+
+    # a retried /complete after processing was queued: nothing left to do, and completing or
+    # enqueueing again would only fail the multipart call or process the file twice
+    if record.status in (UploadStatus.PROCESSING, UploadStatus.COMPLETED):
+        return {"status": record.status.value, "file_id": req.file_id}
+
+    # UPLOADED: the ObjectCreated event already reported the assembled object
+    if record.multipart_upload_id and record.status != UploadStatus.UPLOADED:
+        # s3 only assembles the object once we complete the multipart upload with the part ETags
+        if not req.parts:
+            raise HTTPException(status_code=400, detail="Missing uploaded parts")
+        if not await complete_multipart_upload(
+            record.s3_key,
+            record.multipart_upload_id,
+            [part.model_dump() for part in req.parts],
+        ):
+            # the parts s3 holds are no use anymore (a retry needs a new /upload/init), so free them
+            await abort_multipart_upload(record.s3_key, record.multipart_upload_id)
+            update_upload_status(req.file_id, UploadStatus.FAILED, error_message="Multipart upload could not be completed")
+            raise HTTPException(status_code=400, detail="Multipart upload could not be completed")
+
+    # Verify that the file has been actually uploaded in s3. Normally the bucket's ObjectCreated
+    # event has already marked the record UPLOADED; HEAD the object only if it hasn't arrived yet.
+    elif record.status != UploadStatus.UPLOADED and not await object_exists(record.s3_key):
         raise HTTPException(status_code=400, detail="File not found in storage yet")
     
-    # Update status and enqueue Celery job by sending a task by name
-    # The task "src.tasks.tasks.process_bep_file" is discovered by the celery-worker.
+    # Update status and enqueue Celery job by sending a task by name. The publish runs after the
+    # 202 has gone out (in the threadpool), so the client doesn't wait on the broker round trip.
     update_upload_status(req.file_id, UploadStatus.PROCESSING)
-    taskRes = app.send_task(
-        "process_bep_file",
-        args=[req.file_id, record.s3_key],
-    )
-    print("the task id is : ", taskRes)   # debugging if the task was queued properly
+    background_tasks.add_task(_enqueue_processing, req.file_id, record.s3_key)
 
     return {"status": "processing", "file_id": req.file_id}
 
@@ -120,7 +199,7 @@ async def get_upload_status(file_id: str):
     if not record:
         raise HTTPException(status_code=404, detail="Unknown file_id")
     
-    return UploadStatusResponse(
+    return UploadStatusResponse.model_construct(
         file_id=record.file_id,
         status=record.status,
         original_filename=record.original_filename,
@@ -154,4 +233,4 @@ async def get_artifact_urls(file_id: str):
     for name, s3_key in files.items():
         urls[name] = generate_presigned_get(s3_key)
 
-    return ArtifactURLsResponse(file_id=file_id, **urls)
+    return ArtifactURLsResponse.model_construct(file_id=file_id, **urls)
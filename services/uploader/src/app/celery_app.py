@@ -6,4 +6,15 @@ app = Celery(
     "src",
     broker=settings.celery_broker_url,
     backend=settings.celery_result_backend,
-)
\ No newline at end of file
+)
+
+# must match the worker's routing: process_bep_file is consumed from the "bep" queue
+app.conf.task_routes = {"process_bep_file": {"queue": "bep"}}
+
+# send_task reuses pooled broker connections instead of opening one per request, and task
+# results (which nothing reads back) are dropped from the backend after an hour
+app.conf.update(
+    broker_pool_limit=50,
+    broker_connection_retry_on_startup=True,
+    result_expires=3600,
+)
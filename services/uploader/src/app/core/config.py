@@ -6,6 +6,20 @@ class Settings(BaseSettings):
     aws_secret_access_key: str = "test"
     aws_region: str = "us-east-1"
     s3_bucket: str = "bazel-chatviz-bucket"
+    # LocalStack buckets need a CORS rule for browser uploads, which `python -m app.provision` puts;
+    # set CONFIGURE_LOCALSTACK_CORS=false against real S3, where the bucket policy is managed
+    # outside the app
+    configure_localstack_cors: bool = True
+    # let `python -m app.provision` add the lifecycle rule that aborts abandoned multipart uploads
+    # under bep-files/; on AWS it belongs with the rest of the bucket's lifecycle configuration
+    configure_localstack_lifecycle: bool = True
+    # s3 ObjectCreated events for bep-files/ are delivered to this SQS queue and mark the upload
+    # record UPLOADED, so /upload/complete can usually skip its HEAD request. Empty disables it.
+    upload_events_queue: str = "bep-upload-events"
+    # let `python -m app.provision` create the queue and the bucket notification (LocalStack; the
+    # Dockerfile runs it once before starting the workers). On AWS both are provisioned with the
+    # bucket, along with the queue policy that lets s3 send to it
+    configure_localstack_upload_events: bool = True
 
     # celery_broker_url: str = Field(..., alias="CELERY_BROKER_URL")
     # celery_result_backend: str = Field(..., alias="CELERY_RESULT_BACKEND")
@@ -1,15 +1,122 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import math
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable
+from urllib.parse import quote, unquote_plus, urlsplit
+import aioboto3
 import boto3
 from botocore.exceptions import ClientError
 from app.core.config import settings
 
+log = logging.getLogger(__name__)
+
+# the prefix init_upload writes BEP files under; only these raise upload events
+BEP_PREFIX = "bep-files/"
+
+# uploads above this size go through S3 multipart with one presigned PUT per part.
+# S3 requires every part but the last to be at least 5MB.
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+# The part URLs have to outlive the whole transfer: the parts share the client's uplink no matter
+# how many go in parallel, so size the expiry for the file at MULTIPART_MIN_BYTES_PER_SECOND.
+# Capped at the hour an UPLOADING record lives for.
+MULTIPART_MIN_BYTES_PER_SECOND = 256 * 1024
+MULTIPART_MAX_URL_EXPIRY = 60 * 60
+# multipart uploads nobody completed or aborted are cleaned up by s3 after this many days
+MULTIPART_ABORT_AFTER_DAYS = 1
+
+S3_ENDPOINT = "http://localhost:4566"
+_S3_HOST = urlsplit(S3_ENDPOINT).netloc
+
 _s3_client = boto3.client(
     "s3",
     region_name = settings.aws_region,
     aws_access_key_id = settings.aws_access_key_id,
     aws_secret_access_key = settings.aws_secret_access_key,
-    endpoint_url = "http://localhost:4566"
+    endpoint_url = S3_ENDPOINT
+)
+
+# async session for the calls made from inside request handlers, so they don't block the event loop
+_s3_session = aioboto3.Session(
+    region_name = settings.aws_region,
+    aws_access_key_id = settings.aws_access_key_id,
+    aws_secret_access_key = settings.aws_secret_access_key,
 )
 
+# one async client (and its connection pool) per process, opened and closed by the app's
+# startup/shutdown hooks instead of a new client per request
+_s3_async = None
+_s3_async_stack = AsyncExitStack()
+
+
+async def open_s3_client():
+    global _s3_async
+    if _s3_async is None:
+        _s3_async = await _s3_async_stack.enter_async_context(
+            _s3_session.client("s3", endpoint_url = S3_ENDPOINT)
+        )
+
+
+async def close_s3_client():
+    global _s3_async
+    _s3_async = None
+    await _s3_async_stack.aclose()
+
+
+# Presigned URLs and POST forms are signed here with SigV4 directly from the static credentials.
+# Going through the boto3 client costs a trip through botocore's event system, endpoint
+# resolution and request serialization on every call just to produce a signature.
+# URLs are path-style (endpoint/bucket/key).
+
+@lru_cache(maxsize=4)
+def _signing_key(datestamp: str) -> bytes:
+    # derived per day: HMAC chain over date, region, service and terminator
+    key = hmac.new(("AWS4" + settings.aws_secret_access_key).encode(), datestamp.encode(), hashlib.sha256).digest()
+    for part in (settings.aws_region, "s3", "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return key
+
+
+def _sign_query(method: str, path: str, query: dict, amz_date: str, headers: dict | None = None) -> str:
+    # returns the canonical query string with X-Amz-Signature appended. headers are signed along
+    # with host (lowercase names), so the request has to carry exactly these values.
+    canonical_query = "&".join(
+        f"{quote(k, safe='~')}={quote(str(v), safe='~')}" for k, v in sorted(query.items())
+    )
+    signed = sorted({"host": _S3_HOST, **(headers or {})}.items())
+    canonical_headers = "".join(f"{name}:{value}\n" for name, value in signed)
+    signed_headers = ";".join(name for name, _ in signed)
+    canonical_request = f"{method}\n{path}\n{canonical_query}\n{canonical_headers}\n{signed_headers}\nUNSIGNED-PAYLOAD"
+    string_to_sign = "\n".join((
+        "AWS4-HMAC-SHA256",
+        amz_date,
+        query["X-Amz-Credential"].split("/", 1)[1],
+        hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ))
+    signature = hmac.new(_signing_key(amz_date[:8]), string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"{canonical_query}&X-Amz-Signature={signature}"
+
+
+def _presign_url(method: str, key: str, expires_in: int, params: dict | None = None, headers: dict | None = None) -> str:
+    amz_date = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    path = f"/{settings.s3_bucket}/{quote(key, safe='/~')}"
+    query = dict(params or {})
+    query.update({
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": f"{settings.aws_access_key_id}/{amz_date[:8]}/{settings.aws_region}/s3/aws4_request",
+        "X-Amz-Date": amz_date,
+        "X-Amz-Expires": str(expires_in),
+        "X-Amz-SignedHeaders": ";".join(sorted({"host", *(headers or {})})),
+    })
+    return f"{S3_ENDPOINT}{path}?{_sign_query(method, path, query, amz_date, headers)}"
+
 
 def setup_localstack_s3_cors():
     try:
@@ -33,34 +140,208 @@ def setup_localstack_s3_cors():
 def generate_presigned_post(Key: str, content_type: str, max_size: int, expires_in: int = 300) -> dict:
     # Generate a presigned URL for POST upload to a fixed S3 key
     # we enforce conditions for file type and size for the client's uploads to s3.
-    setup_localstack_s3_cors()
+    # (the bucket CORS rule is set once before the workers start, see app.provision)
+    now = datetime.utcnow()
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    credential = f"{settings.aws_access_key_id}/{amz_date[:8]}/{settings.aws_region}/s3/aws4_request"
 
-    return _s3_client.generate_presigned_post(
-        Bucket=settings.s3_bucket,
-        Key=Key,
-        Fields={
-            "Content-Type": content_type,
-        },
-        Conditions=[
+    fields = {
+        "Content-Type": content_type,
+        "key": Key,
+        "x-amz-algorithm": "AWS4-HMAC-SHA256",
+        "x-amz-credential": credential,
+        "x-amz-date": amz_date,
+    }
+    # the policy lists every condition s3 checks the form against; the form fields must satisfy it
+    policy = {
+        "expiration": (now + timedelta(seconds=expires_in)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "conditions": [
             {"Content-Type": content_type},
             ["content-length-range", 0, max_size],
+            {"bucket": settings.s3_bucket},
+            {"key": Key},
+            {"x-amz-algorithm": "AWS4-HMAC-SHA256"},
+            {"x-amz-credential": credential},
+            {"x-amz-date": amz_date},
         ],
-        ExpiresIn = expires_in,
+    }
+    fields["policy"] = base64.b64encode(json.dumps(policy).encode()).decode()
+    fields["x-amz-signature"] = hmac.new(
+        _signing_key(amz_date[:8]), fields["policy"].encode(), hashlib.sha256
+    ).hexdigest()
+
+    return {"url": f"{S3_ENDPOINT}/{settings.s3_bucket}", "fields": fields}
+
+
+def multipart_url_expiry(size: int) -> int:
+    return min(MULTIPART_MAX_URL_EXPIRY, 300 + math.ceil(size / MULTIPART_MIN_BYTES_PER_SECOND))
+
+
+async def create_multipart_upload(key: str, content_type: str, size: int, part_size: int = MULTIPART_PART_SIZE) -> dict:
+    # Start a multipart upload and presign one upload_part URL per part so the client
+    # can PUT the parts straight to s3 in parallel.
+    upload = await _s3_async.create_multipart_upload(
+        Bucket=settings.s3_bucket,
+        Key=key,
+        ContentType=content_type,
+    )
+    upload_id = upload["UploadId"]
+    part_count = max(1, math.ceil(size / part_size))
+    expires_in = multipart_url_expiry(size)
+
+    # presigning is local signing with no network I/O, so there is nothing to await.
+    # Each URL signs the exact content-length of its part, so the parts add up to the declared
+    # size; that (checked against max_size at /upload/init) is what bounds a multipart upload.
+    part_urls = [
+        _presign_url(
+            "PUT",
+            key,
+            expires_in,
+            {"partNumber": part_number, "uploadId": upload_id},
+            {"content-length": str(min(part_size, size - (part_number - 1) * part_size))},
+        )
+        for part_number in range(1, part_count + 1)
+    ]
+    return {"upload_id": upload_id, "part_size": part_size, "part_urls": part_urls, "expires_in": expires_in}
+
+
+async def complete_multipart_upload(key: str, upload_id: str, parts: list[dict]) -> bool:
+    # parts: [{"part_number": 1, "etag": "..."}, ...] as reported by the client's PUT responses
+    try:
+        await _s3_async.complete_multipart_upload(
+            Bucket=settings.s3_bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": p["etag"], "PartNumber": p["part_number"]}
+                    for p in sorted(parts, key=lambda p: p["part_number"])
+                ]
+            },
+        )
+        return True
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code == "NoSuchUpload":
+            # already completed by an earlier call (or aborted): done if the object is there
+            return await object_exists(key)
+        if code in ("InvalidPart", "InvalidPartOrder", "EntityTooSmall"):
+            return False
+        raise
+
+
+async def abort_multipart_upload(key: str, upload_id: str) -> None:
+    # frees the parts already stored; s3 bills them until the upload is completed or aborted
+    try:
+        await _s3_async.abort_multipart_upload(Bucket=settings.s3_bucket, Key=key, UploadId=upload_id)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchUpload":
+            raise
+
+
+def setup_multipart_abort_lifecycle():
+    # s3 aborts multipart uploads under BEP_PREFIX that are still open after
+    # MULTIPART_ABORT_AFTER_DAYS, e.g. when the client never called /upload/complete and the record
+    # expired. Note this replaces the bucket's whole lifecycle configuration.
+    _s3_client.put_bucket_lifecycle_configuration(
+        Bucket=settings.s3_bucket,
+        LifecycleConfiguration={
+            "Rules": [
+                {
+                    "ID": "abort-incomplete-bep-uploads",
+                    "Filter": {"Prefix": BEP_PREFIX},
+                    "Status": "Enabled",
+                    "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": MULTIPART_ABORT_AFTER_DAYS},
+                }
+            ]
+        },
     )
 
 
 def generate_presigned_get(key: str, expires_in: int = 300) -> str:
-    return _s3_client.generate_presigned_url(
-        ClientMethod = "get_object",
-        Params ={"Bucket": settings.s3_bucket, "Key": key},
-        ExpiresIn=expires_in,
+    return _presign_url("GET", key, expires_in)
+
+
+def setup_upload_event_queue(queue_name: str, provision: bool) -> str:
+    # returns the queue url; with provision, also creates the queue and points the bucket's
+    # ObjectCreated notifications for BEP_PREFIX at it (both calls are idempotent)
+    # LocalStack serves SQS on the same edge endpoint as s3
+    sqs = boto3.client(
+        "sqs",
+        region_name = settings.aws_region,
+        aws_access_key_id = settings.aws_access_key_id,
+        aws_secret_access_key = settings.aws_secret_access_key,
+        endpoint_url = S3_ENDPOINT,
     )
+    if not provision:
+        return sqs.get_queue_url(QueueName=queue_name)["QueueUrl"]
+
+    queue_url = sqs.create_queue(QueueName=queue_name)["QueueUrl"]
+    queue_arn = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+    _s3_client.put_bucket_notification_configuration(
+        Bucket=settings.s3_bucket,
+        NotificationConfiguration={
+            "QueueConfigurations": [
+                {
+                    "QueueArn": queue_arn,
+                    "Events": ["s3:ObjectCreated:*"],
+                    "Filter": {"Key": {"FilterRules": [{"Name": "prefix", "Value": BEP_PREFIX}]}},
+                }
+            ]
+        },
+    )
+    return queue_url
+
+
+def _created_keys(body: str) -> list[str]:
+    # s3 keys of the ObjectCreated records in one notification; event keys are url-encoded
+    # (space as "+"). The s3:TestEvent sent when the notification is configured has no Records.
+    return [
+        unquote_plus(record["s3"]["object"]["key"])
+        for record in json.loads(body).get("Records", [])
+        if record.get("eventName", "").startswith("ObjectCreated:")
+    ]
+
+
+async def consume_upload_events(queue_url: str, on_created: Callable[[str], None]) -> None:
+    # long-polls the queue and calls on_created(s3_key) for every object s3 reports as created.
+    # on_created is synchronous (a redis call), so it runs in a worker thread.
+    # Runs until cancelled; errors are logged and polling carries on.
+    async with _s3_session.client("sqs", endpoint_url = S3_ENDPOINT) as sqs:
+        while True:
+            try:
+                resp = await sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=20)
+                handled = []
+                for message in resp.get("Messages", []):
+                    try:
+                        keys = _created_keys(message["Body"])
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        # not an s3 notification we understand; redelivering it won't help
+                        log.warning("Dropping malformed upload event %s", message.get("MessageId"))
+                        handled.append(message)
+                        continue
+                    try:
+                        for key in keys:
+                            await asyncio.to_thread(on_created, key)
+                    except Exception:
+                        # left on the queue, so it is redelivered once its visibility timeout lapses
+                        log.exception("Error handling upload event for %s", keys)
+                        continue
+                    handled.append(message)
+                if handled:
+                    await sqs.delete_message_batch(
+                        QueueUrl=queue_url,
+                        Entries=[{"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]} for i, m in enumerate(handled)],
+                    )
+            except Exception:
+                log.exception("Error reading upload events")
+                await asyncio.sleep(5)
 
 
-def object_exists(key: str) -> bool:
+async def object_exists(key: str) -> bool:
     # check existence of an s3 object via head request
     try:
-        _s3_client.head_object(Bucket=settings.s3_bucket, Key=key)
+        await _s3_async.head_object(Bucket=settings.s3_bucket, Key=key)
         return True
     except ClientError as e:
         if e.response["Error"]["Code"] in ("404", "403", "400", "NoSuchKey"):
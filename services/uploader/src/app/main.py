@@ -1,6 +1,20 @@
+import asyncio
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.upload import router as upload_router
+from app.core.config import settings
+from app.core.s3 import (
+    open_s3_client,
+    close_s3_client,
+    setup_upload_event_queue,
+    consume_upload_events,
+)
+from app.models.uploads import mark_uploaded
+
+# INFO by default, so per-request debug logging is skipped cheaply
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
 
 app = FastAPI(title="Uploader Service", version="1.0.0")
 
@@ -17,5 +31,40 @@ app.add_middleware(
     allow_headers=['*'],
 )
 
+@app.on_event("startup")
+async def _open_s3():
+    await open_s3_client()
+
+@app.on_event("shutdown")
+async def _close_s3():
+    await close_s3_client()
+
+
+def _on_bep_created(s3_key: str) -> None:
+    # keys are "bep-files/{file_id}.json", see init_upload
+    mark_uploaded(s3_key.rsplit("/", 1)[-1].removesuffix(".json"))
+
+_upload_events_task = None
+
+@app.on_event("startup")
+async def _start_upload_events():
+    global _upload_events_task
+    if not settings.upload_events_queue:
+        return
+    # the queue is provisioned once by app.provision before the workers start; each worker
+    # only looks it up and consumes
+    try:
+        queue_url = await asyncio.to_thread(setup_upload_event_queue, settings.upload_events_queue, False)
+    except Exception:
+        # without events /upload/complete still works, it just HEADs the object every time
+        log.exception("Upload events disabled")
+        return
+    _upload_events_task = asyncio.create_task(consume_upload_events(queue_url, _on_bep_created))
+
+@app.on_event("shutdown")
+async def _stop_upload_events():
+    if _upload_events_task is not None:
+        _upload_events_task.cancel()
+
 # Attach the router to the main app
 app.include_router(upload_router)
\ No newline at end of file
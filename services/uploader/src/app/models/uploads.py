@@ -3,19 +3,33 @@ from enum import Enum
 from dataclasses import dataclass, field, asdict
 from datetime import datetime
 from typing import Dict, Optional
-import json
-from fastapi.encoders import jsonable_encoder
 
 status_redis = redis.Redis(host="localhost", port=6380, db=0, decode_responses = True)
 
+# HSET the field/value pairs in ARGV[2..] only if the record exists, then set its TTL to ARGV[1]
+# seconds (0 = keep forever), in one atomic round trip
+_update_if_exists = status_redis.register_script(
+    "if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end "
+    "local n = redis.call('HSET', KEYS[1], unpack(ARGV, 2)) "
+    "if tonumber(ARGV[1]) > 0 then redis.call('EXPIRE', KEYS[1], ARGV[1]) else redis.call('PERSIST', KEYS[1]) end "
+    "return n"
+)
+
+# HSET status to ARGV[2] only while it is still ARGV[1], so a late event can't move a record back
+_set_status_if = status_redis.register_script(
+    "if redis.call('HGET', KEYS[1], 'status') == ARGV[1] then return redis.call('HSET', KEYS[1], 'status', ARGV[2]) end return -1"
+)
+
 class UploadStatus(str, Enum):
     UPLOADING = "uploading"
+    UPLOADED = "uploaded"       # s3 reported the object; set from the bucket's ObjectCreated events
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
 
 
-@dataclass
+# slots: no per-instance __dict__
+@dataclass(slots=True)
 class UploadRecord:
     file_id: str
     s3_key: str
@@ -27,6 +41,7 @@ class UploadRecord:
     completed_at: Optional[datetime] = None
     error_message: Optional[str] = None
     output_json_url: Optional[str] = None
+    multipart_upload_id: Optional[str] = None    # set when the file is sent to s3 in parts
 
 # # in-memory store for now, will replace with real DB later.
 # UPLOAD_STORE: Dict[str, UploadRecord] = {}
@@ -35,25 +50,52 @@ def _upload_key(file_id: str) -> str:
     return f"upload:{file_id}"
 
 
+# records expire on their own: an upload that never finishes is reaped after an hour, and a
+# completed/failed one is kept for a day. Records being processed don't expire.
+UPLOADING_TTL_SECONDS = 60 * 60
+TERMINAL_TTL_SECONDS = 24 * 60 * 60
+
+
+# each record is stored as a redis hash of its fields, so status updates can write only the
+# fields that change. Hash values are strings and None fields are simply left out.
+def _to_hash(record: UploadRecord) -> Dict[str, str]:
+    mapping = {}
+    for name, value in asdict(record).items():
+        if value is None:
+            continue
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, UploadStatus):
+            value = value.value
+        mapping[name] = str(value)
+    return mapping
+
+
 # create and upload entry when upload/init is called
-def create_upload_record(file_id: str, s3_key: str, original_filename: str, content_type: str, max_size: int) -> UploadRecord:
+def create_upload_record(file_id: str, s3_key: str, original_filename: str, content_type: str, max_size: int, multipart_upload_id: Optional[str] = None) -> UploadRecord:
     record = UploadRecord(
         file_id = file_id,
         s3_key = s3_key,
         original_filename = original_filename,
         content_type = content_type,
         max_size = max_size,
+        multipart_upload_id = multipart_upload_id,
     )
     # UPLOAD_STORE[file_id] = record
-    status_redis.set(_upload_key(file_id), json.dumps(jsonable_encoder(record)))
+    key = _upload_key(file_id)
+    pipe = status_redis.pipeline()
+    pipe.hset(key, mapping=_to_hash(record))
+    pipe.expire(key, UPLOADING_TTL_SECONDS)
+    pipe.execute()
     return record
 
 # Retrieve metadata for particular upload
 def get_upload_record(file_id: str) -> Optional[UploadRecord]:
-    data = status_redis.get(_upload_key(file_id))
-    if not data:
+    d = status_redis.hgetall(_upload_key(file_id))
+    if not d:
         return None
-    d = json.loads(data)
+
+    d["max_size"] = int(d["max_size"])
 
     #converting timestamps back to datetime
     if d.get("created_at"):
@@ -71,15 +113,23 @@ def get_upload_record(file_id: str) -> Optional[UploadRecord]:
 # updates the lifecycle of upload during processing.
 def update_upload_status(file_id: str, status: UploadStatus, error_message: Optional[str] = None, output_location: Optional[str] = None):
     # record = UPLOAD_STORE.get(file_id)
-    record = get_upload_record(file_id)
-    if not record:
-        return
-    record.status = status
+    # only the changed fields are written; no need to read and re-serialize the whole record
+    changes = {"status": status.value}
+    ttl = 0
     if status in (UploadStatus.COMPLETED, UploadStatus.FAILED):
-        record.completed_at = datetime.utcnow()
+        changes["completed_at"] = datetime.utcnow().isoformat()
+        ttl = TERMINAL_TTL_SECONDS
+    elif status == UploadStatus.UPLOADING:
+        ttl = UPLOADING_TTL_SECONDS
     if error_message:
-        record.error_message = error_message
+        changes["error_message"] = error_message
     if output_location:
-        record.output_json_url = output_location
-    status_redis.set(_upload_key(file_id), json.dumps(jsonable_encoder(record)))
-    
\ No newline at end of file
+        changes["output_json_url"] = output_location
+    _update_if_exists(keys=[_upload_key(file_id)], args=[ttl, *(x for item in changes.items() for x in item)])
+    
+
+
+# marks an upload UPLOADED once s3 reports the object. Only a record still UPLOADING moves, so an
+# event arriving after /upload/complete has queued processing leaves the record alone.
+def mark_uploaded(file_id: str) -> bool:
+    return _set_status_if(keys=[_upload_key(file_id)], args=[UploadStatus.UPLOADING.value, UploadStatus.UPLOADED.value]) != -1
@@ -0,0 +1,34 @@
+import logging
+from app.core.config import settings
+from app.core.s3 import setup_localstack_s3_cors, setup_upload_event_queue, setup_multipart_abort_lifecycle
+
+# One-off setup run before uvicorn starts its workers (see the Dockerfile), so the bucket CORS
+# and lifecycle rules, the upload events queue and the bucket notification are provisioned once
+# rather than by every worker process.
+log = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if settings.configure_localstack_cors:
+        try:
+            setup_localstack_s3_cors()
+        except Exception:
+            log.exception("Could not set the bucket CORS rule")
+    if settings.configure_localstack_lifecycle:
+        try:
+            setup_multipart_abort_lifecycle()
+        except Exception:
+            log.exception("Could not set the multipart abort lifecycle rule")
+    if not (settings.upload_events_queue and settings.configure_localstack_upload_events):
+        return
+    try:
+        setup_upload_event_queue(settings.upload_events_queue, provision=True)
+        log.info("Upload events queue %s provisioned", settings.upload_events_queue)
+    except Exception:
+        # the workers then fail to find the queue and fall back to HEAD requests
+        log.exception("Could not provision the upload events queue")
+
+
+if __name__ == "__main__":
+    main()